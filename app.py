@@ -1,31 +1,81 @@
 import logging
 import asyncio
 import os
+import signal
+import socket
 import time
+import uvloop
 from aiohttp import web
+asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
 logging.basicConfig(level=logging.INFO,
                     format='%(asctime)s - %(levelname)s - %(message)s')
 HOST = "127.0.0.1"
 PORT = "9000"
+KEEPALIVE_TIMEOUT = 75
+BACKLOG = 1024
+WORKERS = os.cpu_count() or 1
+INDEX_BODY = "<h1>Hello World</h1>".encode()
+INDEX_HEADERS = {"Content-Type": "text/html; charset=utf-8"}
 
 
-async def init(loop):
-    app = web.Application(loop=loop)
+def create_socket():
+    """
+    listening socket shared by all workers through SO_REUSEPORT,
+    Nagle is disabled so small responses are flushed at once
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    sock.bind((HOST, int(PORT)))
+    sock.listen(BACKLOG)
+    return sock
+
+
+def init():
+    app = web.Application()
     app.router.add_route("GET", "/", index)
-    server = await loop.create_server(app.make_handler(), HOST, PORT)
-    logging.info("Server started at http://{}:{}".format(HOST, PORT))
-    return server
+    return app
+
 
+async def index(request):
+    return web.Response(body=INDEX_BODY, headers=INDEX_HEADERS)
 
-def index(request):
-    resp = "<h1>Hello World</h1>"
-    return web.Response(body=resp.encode(), content_type="text/html")
+
+def stop_workers(pids):
+    """
+    terminate forked workers and reap them
+    """
+    for pid in pids:
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+    for pid in pids:
+        try:
+            os.waitpid(pid, 0)
+        except ChildProcessError:
+            pass
 
 
 def main():
-    loop = asyncio.get_event_loop()
-    loop.run_until_complete(init(loop))
-    loop.run_forever()
+    workers = []
+    for _ in range(WORKERS - 1):
+        pid = os.fork()
+        if pid == 0:
+            workers = []
+            break
+        workers.append(pid)
+    try:
+        sock = create_socket()
+        logging.info("Server started at http://{}:{} (pid {})".format(
+            HOST, PORT, os.getpid()
+        ))
+        web.run_app(init(), sock=sock,
+                    keepalive_timeout=KEEPALIVE_TIMEOUT, backlog=BACKLOG,
+                    print=None)
+    finally:
+        stop_workers(workers)
+
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
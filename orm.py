@@ -1,21 +1,27 @@
 import aiomysql
+import functools
 import logging
-import numbers
+import operator
 from collections.abc import Sequence, Iterator
-logging.basicConfig(level=logging.INFO,
-                    format='%(asctime)s - %(levelname)s - %(message)s')
+log = logging.getLogger(__name__)
+_INT_TYPES = (int,)
+_RAT_TYPES = (int, float)
 
 
-async def create_pool(loop, **kwargs):
+async def create_pool(**kwargs):
     """
     create connection pool for mysql connections
     using global variable __pool to access pool
+    minsize connections are opened up front so early requests skip the
+    handshake, set minsize/maxsize close to the expected concurrency
     """
-    logging.info("Create database connection pool...")
+    log.info("Create database connection pool...")
     global __pool
+    maxsize = kwargs.get("maxsize", 100)
     __pool = await aiomysql.create_pool(
-        maxsize=kwargs.get("maxsize", 100),
-        loop=loop,
+        minsize=kwargs.get("minsize", min(10, maxsize)),
+        maxsize=maxsize,
+        autocommit=kwargs.get("autocommit", True),
         host=kwargs.get("host", "127.0.0.1"),
         port=kwargs.get("port", 3306),
         user=kwargs["user"],
@@ -23,41 +29,212 @@ async def create_pool(loop, **kwargs):
         db=kwargs["db"],
         charset=kwargs.get("charset", "utf8")
     )
-    logging.info("Connect successful")
+    log.info("Connect successful")
 
-async def select(sql, params=[], size=None):
+@functools.lru_cache(maxsize=1024)
+def _to_pyformat(sql):
     """
-    Wrap SELECT and retrurn a list of selected rows
+    translate "?" placeholders to the "%s" style aiomysql expects
     """
-    logging.info("SQL: {} {}".format(sql, params))
-    async with __pool.acquire() as conn:
-        cur = await conn.cursor(aiomysql.DictCursor)
-        await cur.execute(sql.replace("?", "%s"), params)
-        if size:
-            rs = await cur.fetchmany(size)
-        else:
-            rs = await cur.fetchall()
-        await cur.close()
-        logging.info("rows returned: {}".format(len(rs)))
-        return rs
-
-async def execute(sql, params=[]):
+    return sql.replace("?", "%s")
+
+
+def session():
     """
-    wrap INSERT UPDATE DELETE and return affected row number
+    create a Session on the global pool
     """
-    logging.info("SQL: {} {}".format(sql, params))
-    async with __pool.acquire() as conn:
-        cur = await conn.cursor(aiomysql.DictCursor)
+    return Session(__pool)
+
+
+class Session:
+    """
+    Hold one pooled connection and cursor for a unit of work
+    statements given this session share a single transaction,
+    which is committed on exit or rolled back on exception
+    """
+    def __init__(self, pool):
+        self.pool = pool
+        self.conn = None
+        self.cur = None
+
+    async def __aenter__(self):
+        self.conn = await self.pool.acquire()
         try:
-            await cur.execute(sql.replace("?", "%s"), params)
-            affected = cur.rowcount
-            await conn.commit()
+            await self.conn.begin()
+            self.cur = await self.conn.cursor()
         except BaseException:
-            logging.info("EXCEPTION OCCURED, ROLLBACK")
-            await conn.rollback()
+            self.pool.release(self.conn)
+            self.conn = self.cur = None
             raise
-        logging.info("rows affected: {}".format(affected))
-        return affected
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        try:
+            await self.cur.close()
+            if exc_type is None:
+                await self.conn.commit()
+            else:
+                log.info("EXCEPTION OCCURED, ROLLBACK")
+                await self.conn.rollback()
+        finally:
+            self.pool.release(self.conn)
+            self.conn = self.cur = None
+
+
+async def _fetch(cur, sql, params, size):
+    await cur.execute(_to_pyformat(sql), params)
+    if size:
+        rs = await cur.fetchmany(size)
+    else:
+        rs = await cur.fetchall()
+    return cur.description, rs
+
+
+async def select(sql, params=[], size=None, session=None):
+    """
+    Wrap SELECT and retrurn column description with a list of
+    selected rows, rows are plain tuples
+    """
+    log.debug("SQL: %s %s", sql, params)
+    if session is not None:
+        description, rs = await _fetch(session.cur, sql, params, size)
+    else:
+        async with __pool.acquire() as conn:
+            cur = await conn.cursor()
+            description, rs = await _fetch(cur, sql, params, size)
+            await cur.close()
+    log.debug("rows returned: %s", len(rs))
+    return description, rs
+
+async def select_stream(sql, params=[], batch=1000):
+    """
+    Wrap SELECT on a server side cursor and yield rows as they arrive,
+    at most batch rows are held in memory at once
+    the pooled connection is held until the generator finishes, so
+    callers which may stop early must close it, e.g.
+    async with contextlib.aclosing(select_stream(sql)) as rows: ...
+    closing drains the unread rest of the result set
+    """
+    log.debug("SQL: %s %s", sql, params)
+    async with __pool.acquire() as conn:
+        cur = await conn.cursor(aiomysql.SSCursor)
+        try:
+            await cur.execute(_to_pyformat(sql), params)
+            while True:
+                rs = await cur.fetchmany(batch)
+                if not rs:
+                    break
+                for row in rs:
+                    yield row
+        finally:
+            await cur.close()
+
+async def execute(sql, params=[], session=None):
+    """
+    wrap INSERT UPDATE DELETE and return affected row number
+    explicit COMMIT is only sent when the connection is not in
+    autocommit mode, use a Session to group statements in one transaction
+    """
+    log.debug("SQL: %s %s", sql, params)
+    if session is not None:
+        await session.cur.execute(_to_pyformat(sql), params)
+        affected = session.cur.rowcount
+    else:
+        async with __pool.acquire() as conn:
+            cur = await conn.cursor()
+            try:
+                await cur.execute(_to_pyformat(sql), params)
+                affected = cur.rowcount
+                if not conn.get_autocommit():
+                    await conn.commit()
+            except BaseException:
+                log.info("EXCEPTION OCCURED, ROLLBACK")
+                await conn.rollback()
+                raise
+    log.debug("rows affected: %s", affected)
+    return affected
+
+
+async def executemany(sql, seq_params, session=None):
+    """
+    wrap batched INSERT UPDATE DELETE in a single round of commit
+    and return affected row number
+    batches run in an explicit transaction so autocommit connections
+    do not commit once per statement
+    """
+    log.debug("SQL: %s %s", sql, seq_params)
+    if session is not None:
+        await session.cur.executemany(_to_pyformat(sql), seq_params)
+        affected = session.cur.rowcount
+    else:
+        async with __pool.acquire() as conn:
+            cur = await conn.cursor()
+            batched = len(seq_params) > 1
+            try:
+                if batched and conn.get_autocommit():
+                    await conn.begin()
+                await cur.executemany(_to_pyformat(sql), seq_params)
+                affected = cur.rowcount
+                if batched or not conn.get_autocommit():
+                    await conn.commit()
+            except BaseException:
+                log.info("EXCEPTION OCCURED, ROLLBACK")
+                await conn.rollback()
+                raise
+    log.debug("rows affected: %s", affected)
+    return affected
+
+
+@functools.lru_cache(maxsize=256)
+def _build_select(cls, keys, orderby, limit_size):
+    """
+    build SELECT template for given where keys, orderby and limit shape
+    column names are checked against the model before interpolated,
+    templates are cached since the same query shapes repeat
+    """
+    for k in keys + ((orderby,) if orderby else ()):
+        if k not in cls.__fields_set__:
+            raise ValueError("Unknown field for type {}: {}".format(
+                cls.__name__, k
+            ))
+    sql = "select {} from `{}`".format(
+        ", ".join(["`{}`".format(f) for f in cls.__fields__]), cls.__table__
+    )
+    if keys:
+        sql += " where " + " and ".join(["`{}`=%s".format(k) for k in keys])
+    if orderby:
+        sql += " order by `{}`".format(orderby)
+    if limit_size:
+        sql += " limit " + ", ".join(["%s"] * limit_size)
+    return sql + ";"
+
+
+def _tuple_getter(names):
+    """
+    attrgetter which always returns a tuple, even for one or no names
+    """
+    if not names:
+        return lambda obj: ()
+    if len(names) == 1:
+        getter = operator.attrgetter(names[0])
+        return lambda obj: (getter(obj),)
+    return operator.attrgetter(*names)
+
+
+def _compile_fill(storage_names):
+    """
+    generate function which stores a row into storage names positionally,
+    plain attribute stores skip descriptor dispatch and validation
+    """
+    if storage_names:
+        body = "{}, = row".format(
+            ", ".join(["obj.{}".format(n) for n in storage_names])
+        )
+    else:
+        body = "pass"
+    ns = {}
+    exec("def _fill(obj, row):\n    {}\n".format(body), {}, ns)
+    return ns["_fill"]
 
 
 class ModelMeta(type):
@@ -65,20 +242,30 @@ class ModelMeta(type):
     Metaclass of building Model
     add table infomation to Model
     discriptor's storage_name is also assigned here
+    and storage names become __slots__ so instances carry no __dict__
     """
+    def __new__(meta, name, bases, attr_dict):
+        if not name == "Model":
+            slots = []
+            for k, v in attr_dict.items():
+                if isinstance(v, Field):
+                    v.storage_name = "_{}_{}".format(type(v).__name__, k)
+                    slots.append(v.storage_name)
+            attr_dict["__slots__"] = tuple(slots)
+        return super().__new__(meta, name, bases, attr_dict)
+
     def __init__(cls, name, bases, attr_dict):
         super().__init__(name, bases, attr_dict)
         if not name == "Model":
             table_name = name
+            mapping = {}
             default_mapping = {}
             fields = []
             primary_key = None
             for k, v in attr_dict.items():
                 if isinstance(v, Field):
-                    v.storage_name = "_{}#{}".format(
-                        type(v).__name__, k
-                    )
                     fields.append(k)
+                    mapping[k] = v
                     if v.primary_key:
                         if primary_key:
                             raise RuntimeError("Duplicated primary key")
@@ -87,8 +274,29 @@ class ModelMeta(type):
                         default_mapping[k] = v.default
             cls.__table__ = table_name
             cls.__fields__ = fields
+            cls.__fields_set__ = frozenset(fields)
+            cls.__mapping__ = mapping
             cls.__primary_key__ = primary_key
             cls.__default__ = default_mapping
+            cls.__row_getter__ = staticmethod(_tuple_getter(fields))
+            cls.__fill__ = staticmethod(_compile_fill(
+                [mapping[k].storage_name for k in fields]
+            ))
+            cls.__pk_getter__ = staticmethod(
+                operator.attrgetter(primary_key) if primary_key else None
+            )
+            # aiomysql only speaks the text protocol (no COM_STMT_PREPARE),
+            # so statements are prepared client side: built once per class,
+            # leaving only parameter escaping to each call
+            cls.__insert_sql__ = "insert into `{}` values ({});".format(
+                table_name, cls.create_args_string(len(fields))
+            )
+            cls.__update_sql__ = "update `{}` set {} where `{}`=%s;".format(
+                table_name, cls.create_kwargs_string(fields), primary_key
+            )
+            cls.__delete_sql__ = "delete from `{}` where `{}`=%s".format(
+                table_name, primary_key
+            )
 
 
 class Field:
@@ -109,8 +317,12 @@ class Field:
 
     def validate(self, instance, d_type, value):
         if not isinstance(value, d_type):
+            if isinstance(d_type, tuple):
+                expected = " or ".join(t.__name__ for t in d_type)
+            else:
+                expected = d_type.__name__
             raise TypeError("Type {} expected, got {}".format(
-                d_type.__name__, type(value)
+                expected, type(value)
             ))
         return value
 
@@ -129,7 +341,7 @@ class IntegerField(Field):
         super().__init__("bigint", primary_key, default)
 
     def validate(self, instance, d_type, value):
-        return super().validate(instance, numbers.Integral, value)
+        return super().validate(instance, _INT_TYPES, value)
 
 
 class StringField(Field):
@@ -153,95 +365,139 @@ class FloatField(Field):
         super().__init__("real", primary_key, default)
 
     def validate(self, instance, d_type, value):
-        return super().validate(instance, numbers.Rational, value)
+        return super().validate(instance, _RAT_TYPES, value)
 
 
 class Model(metaclass=ModelMeta):
     """
     Model base class which maps table in database
     """
+    __slots__ = ()
+
     def __init__(self, **kwargs):
-        default_used = set(self.__default__.keys()) - set(kwargs.keys())
-        for attr in set(self.__fields__) & set(kwargs.keys()):
-            setattr(self, attr, kwargs.pop(attr))
-        for attr in default_used:
-            setattr(self, attr, next(self.__default__[attr]))
-        if len(kwargs):
+        used = 0
+        for attr in self.__fields__:
+            if attr in kwargs:
+                setattr(self, attr, kwargs[attr])
+                used += 1
+            elif attr in self.__default__:
+                setattr(self, attr, next(self.__default__[attr]))
+        if used < len(kwargs):
+            unused = {k: v for k, v in kwargs.items()
+                      if k not in self.__fields_set__}
             raise AttributeError("Unused attribute for type {}: {}".format(
-                self.__class__.__name__, kwargs
+                self.__class__.__name__, unused
             ))
 
+    @staticmethod
+    def session():
+        return session()
+
     @classmethod
     async def get(cls, **kwargs):
-        sql = ["select * from `{}`".format(cls.__name__)]
-        args = []
+        session = kwargs.pop("session", None)
+        sql, args = cls._prepare_select(kwargs)
+        _, rs = await select(sql, args, session=session)
+        return [cls._load(row) for row in rs]
+
+    @classmethod
+    async def iter(cls, **kwargs):
+        """
+        stream matching instances instead of building the whole list,
+        takes the same arguments as get except session, plus batch
+        callers which may stop early must close it, see select_stream
+        """
+        if kwargs.pop("session", None) is not None:
+            raise ValueError(
+                "iter does not support session, "
+                "a server side cursor needs its own connection"
+            )
+        batch = kwargs.pop("batch", 1000)
+        sql, args = cls._prepare_select(kwargs)
+        async for row in select_stream(sql, args, batch):
+            yield cls._load(row)
+
+    @classmethod
+    def _prepare_select(cls, kwargs):
         orderby = kwargs.pop("orderby", None)
         limit = kwargs.pop("limit", None)
-        if len(kwargs):
-            sql.append("where")
-            argfmt = []
-            for k, v in kwargs.items():
-                argfmt.append("`?`=?")
-                args.append(k)
-                args.append(v)
-            sql.append(" and ".join(argfmt))
-        if orderby:
-            sql.append("order by `?`")
-            args.append(orderby)
+        args = list(kwargs.values())
+        limit_size = 0
         if limit:
-            sql.append("limit")
             if isinstance(limit, int):
-                sql.append("?")
+                limit_size = 1
                 args.append(limit)
             elif isinstance(limit, Sequence) and len(limit) == 2:
-                sql.append("?,?")
+                limit_size = 2
                 args.extend(list(limit))
             else:
                 raise ValueError("limit must be an integer or binary sequence")
-        sql = " ".join(sql) + ";"
-        rs = await select(sql, args)
-        return [cls(**each) for each in rs]
+        return _build_select(cls, tuple(kwargs), orderby, limit_size), args
+
+    @classmethod
+    def _load(cls, row):
+        """
+        build instance from a database row without field validation,
+        values are already typed by the driver and ordered as __fields__
+        """
+        obj = cls.__new__(cls)
+        cls.__fill__(obj, row)
+        return obj
 
     @staticmethod
     def create_args_string(num):
-        return ", ".join(["?"] * num)
+        return ", ".join(["%s"] * num)
 
     @staticmethod
     def create_kwargs_string(keys):
-        return ", ".join(["`{}`=?".format(key) for key in keys])
+        return ", ".join(["`{}`=%s".format(key) for key in keys])
 
-    async def insert(self):
-        sql = "insert into `{}` values ({});".format(
-            self.__table__, self.create_args_string(len(self.__fields__))
+    @classmethod
+    async def insert_many(cls, objs, session=None):
+        if not objs:
+            return
+        args = [cls.__row_getter__(obj) for obj in objs]
+        affected = await executemany(
+            cls.__insert_sql__, args, session=session
         )
-        args = [getattr(self, name) for name in self.__fields__]
-        if await execute(sql, args) < 1:
-            logging.warn("Failed to insert row. Primary key: {}".format(
-                getattr(self, self.__primary_key__)
-            ))
+        if affected < len(objs):
+            log.warning("Failed to insert rows. Primary keys: %s",
+                        [cls.__pk_getter__(obj) for obj in objs])
 
-    async def update(self):
-        sql = "update `{}` set {} where `{}`=?;".format(
-            self.__table__,
-            self.create_kwargs_string(self.__fields__),
-            self.__primary_key__
+    @classmethod
+    async def update_many(cls, objs, session=None):
+        if not objs:
+            return
+        row_getter, pk_getter = cls.__row_getter__, cls.__pk_getter__
+        args = [row_getter(obj) + (pk_getter(obj),) for obj in objs]
+        affected = await executemany(
+            cls.__update_sql__, args, session=session
         )
-        args = [getattr(self, name) for name in self.__fields__]
-        args.append(getattr(self, self.__primary_key__))
-        if await execute(sql, args) < 1:
-            logging.warn("Failed to update row. Primary key: {}".format(
-                getattr(self, self.__primary_key__)
-            ))
+        if affected < len(objs):
+            log.warning("Failed to update rows. Primary keys: %s",
+                        [cls.__pk_getter__(obj) for obj in objs])
 
-    async def delete(self):
-        sql = "delete from `{}` where `{}`=?".format(
-            self.__table__, self.__primary_key__
+    @classmethod
+    async def delete_many(cls, objs, session=None):
+        if not objs:
+            return
+        pk_getter = cls.__pk_getter__
+        args = [(pk_getter(obj),) for obj in objs]
+        affected = await executemany(
+            cls.__delete_sql__, args, session=session
         )
-        args = [getattr(self, self.__primary_key__)]
-        if await execute(sql, args) < 1:
-            logging.warn("Failed to delete row. Primary key: {}".format(
-                getattr(self, self.__primary_key__)
-            ))
+        if affected < len(objs):
+            log.warning("Failed to delete rows. Primary keys: %s",
+                        [cls.__pk_getter__(obj) for obj in objs])
+
+    async def insert(self, session=None):
+        await self.insert_many([self], session=session)
+
+    async def update(self, session=None):
+        await self.update_many([self], session=session)
+
+    async def delete(self, session=None):
+        await self.delete_many([self], session=session)
 
     
 # from itertools import count
@@ -254,7 +510,7 @@ class Model(metaclass=ModelMeta):
 # def unit_test():
 #     loop = asyncio.get_event_loop()
 #     loop.run_until_complete(create_pool(
-#         loop, user="root", password="solar", db="indigo"))
+#         user="root", password="solar", db="indigo"))
 #     a = Test(name="I finished the orm!")
 #     loop.run_until_complete(a.insert())
 #     res = loop.run_until_complete(Test.get())